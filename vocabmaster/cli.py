@@ -1,12 +1,53 @@
-import platform
 import sys
 
 import click
-import openai
-from vocabmaster import config_handler, csv_handler, gpt_integration
+from vocabmaster import config_handler, csv_handler
 
 from .utils import *
 
+# Messages shown by several commands, built once
+ADD_HELP_HINT = f"Run '{BOLD}vocabmaster add --help{RESET}' for more information."
+CONFIG_DEFAULT_HINT = (
+    f"{BLUE}You can change the default language pair at any time by running:{RESET}\n"
+    f"{BOLD}vocabmaster config default{RESET}"
+)
+RATE_LIMIT_GUIDANCE = f"""
+{BLUE}You might not have set a usage rate limit in your OpenAI account settings.{RESET}
+If that's the case, you can set it here:
+https://platform.openai.com/account/billing/limits
+
+{BLUE}If you have set a usage rate limit, please try the following steps:{RESET}
+- Wait a few seconds before trying again.
+
+- Reduce your request rate or batch tokens. You can read the OpenAI rate limits here:
+https://platform.openai.com/account/rate-limits
+
+- If you are using the free plan, you can upgrade to the paid plan here:
+https://platform.openai.com/account/billing/overview
+
+- If you are using the paid plan, you can increase your usage rate limit here:
+https://platform.openai.com/account/billing/limits
+"""
+
+
+class CLIAbort(click.ClickException):
+    """
+    Aborts the current command with an error message and an optional hint.
+
+    Click shows the message and exits with a nonzero code, instead of the command calling
+    `sys.exit` itself. With `standalone_mode=False`, Click re-raises the exception to the caller
+    instead, so the commands can be invoked several times from the same Python process.
+    """
+
+    def __init__(self, message, hint=None):
+        super().__init__(str(message))
+        self.hint = hint
+
+    def show(self, file=None):
+        click.echo(f"{RED}Error:{RESET} {self.format_message()}", file=file)
+        if self.hint:
+            click.echo(self.hint, file=file)
+
 
 @click.group()
 @click.version_option()
@@ -53,20 +94,14 @@ def add(pair, word):
 
     Examples: 'good', 'to be', 'a cat'
     """
-    try:
-        language_to_learn, mother_tongue = config_handler.get_language_pair(pair)
-    except Exception as error:
-        click.echo(f"{RED}Error:{RESET} {error}")
-        sys.exit(1)
-
-    translations_filepath, anki_filepath = setup_files(
-        setup_dir(), language_to_learn, mother_tongue
+    language_to_learn, mother_tongue, translations_filepath, anki_filepath = resolve_pair_and_paths(
+        pair
     )
 
     if not word:
         click.echo()
         click.echo("Please provide a word to add.")
-        click.echo(f"Run '{BOLD}vocabmaster add --help{RESET}' for more information.")
+        click.echo(ADD_HELP_HINT)
         sys.exit(0)
 
     word = " ".join(word)
@@ -93,7 +128,17 @@ def add(pair, word):
     help="Show the number of words remaining to be translated in the vocabulary list.",
     required=False,
 )
-def translate(pair, count):
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help=(
+        "Split the words into this many requests, sent in parallel. Faster for long lists,"
+        " but the translations are not streamed."
+    ),
+)
+def translate(pair, count, concurrency):
     """
     Translate, Add examples, and Generate an Anki deck.
 
@@ -102,14 +147,8 @@ def translate(pair, count):
 
     The generated Anki deck will be saved in the same folder as your vocabulary list.
     """
-    try:
-        language_to_learn, mother_tongue = config_handler.get_language_pair(pair)
-    except Exception as error:
-        click.echo(f"{RED}Error:{RESET} {error}")
-        sys.exit(1)
-
-    translations_filepath, anki_filepath = setup_files(
-        setup_dir(), language_to_learn, mother_tongue
+    language_to_learn, mother_tongue, translations_filepath, anki_filepath = resolve_pair_and_paths(
+        pair
     )
 
     # Add the fieldnames to the CSV file if it's missing
@@ -120,15 +159,17 @@ def translate(pair, count):
     # Check if the vocabulary list is empty
     if csv_handler.vocabulary_list_is_empty(translations_filepath):
         click.echo(f"{RED}Your vocabulary list is empty.{RESET} Please add some words first.")
-        click.echo(f"Run '{BOLD}vocabmaster add --help{RESET}' for more information.")
+        click.echo(ADD_HELP_HINT)
         sys.exit(0)
 
     # Show untranslated words count if `--count` is used, then exit.
     if count:
-        try:
-            number_words = len(csv_handler.get_words_to_translate(translations_filepath))
-        except Exception as error:
-            click.echo(f"{GREEN}Status:{RESET} {error}")
+        number_words = csv_handler.count_words_to_translate(translations_filepath)
+        if number_words == 0:
+            click.echo(
+                f"{GREEN}Status:{RESET} All the words in the vocabulary list already have"
+                " translations and examples"
+            )
         else:
             click.echo(f"Number of words to translate: {BLUE}{number_words}{RESET}")
         sys.exit(0)
@@ -143,13 +184,18 @@ def translate(pair, count):
     click.echo(f"{BLUE}This may take a while...{RESET}")
     click.echo()
 
+    # Imported here, as loading openai is slow and the other commands don't need it
+    import openai
+
     try:
-        csv_handler.add_translations_and_examples_to_file(translations_filepath, pair)
+        skipped_lines = csv_handler.add_translations_and_examples_to_file(
+            translations_filepath, pair, concurrency
+        )
         click.echo()
     except openai.error.RateLimitError as error:
-        click.echo(click.style("Error: ", fg="red") + f"{error}")
+        click.echo(f"{RED}Error:{RESET} {error}")
         handle_rate_limit_error()
-        sys.exit(1)
+        raise click.exceptions.Exit(1)
     except Exception as error:
         if (
             str(error) == "All the words in the vocabulary list already have translations and"
@@ -169,10 +215,46 @@ def translate(pair, count):
         f" list{RESET} 💡✅"
     )
 
+    # Report the lines of the GPT response that couldn't be parsed
+    if skipped_lines:
+        click.echo()
+        click.echo(
+            f"{ORANGE}Warning:{RESET} {len(skipped_lines)} line(s) of the response couldn't be"
+            " parsed, so some words may still be missing translations and examples:"
+        )
+        for line in skipped_lines:
+            click.echo(f"  {line}")
+        click.echo(
+            f"Run '{BOLD}vocabmaster translate{RESET}' again to translate the remaining words."
+        )
+
     # Generate the Anki deck
     generate_anki_deck(translations_filepath, anki_filepath)
 
 
+def resolve_pair_and_paths(pair):
+    """
+    Resolves the language pair and the paths of its files in one go.
+
+    Args:
+        pair (str): The language pair in the format 'language_to_learn:mother_tongue'.
+            If empty, the default language pair is used.
+
+    Returns:
+        tuple: The language to learn, the mother tongue, the path to the translations file,
+            and the path to the Anki deck file.
+    """
+    try:
+        language_to_learn, mother_tongue = config_handler.get_language_pair(pair)
+    except Exception as error:
+        raise CLIAbort(str(error)) from error
+
+    translations_filepath, anki_filepath = setup_files(
+        setup_dir(), language_to_learn, mother_tongue
+    )
+    return language_to_learn, mother_tongue, translations_filepath, anki_filepath
+
+
 def generate_anki_deck(translations_filepath, anki_filepath):
     """
     Generates an Anki deck file from a translations file and saves it to the specified path.
@@ -207,12 +289,7 @@ def anki():
 
     The Anki deck will be saved in the same folder as your vocabulary list.
     """
-    language_to_learn = config_handler.get_default_language_pair()["language_to_learn"]
-    mother_tongue = config_handler.get_default_language_pair()["mother_tongue"]
-
-    translations_filepath, anki_filepath = setup_files(
-        setup_dir(), language_to_learn, mother_tongue
-    )
+    _, _, translations_filepath, anki_filepath = resolve_pair_and_paths(None)
 
     generate_anki_deck(translations_filepath, anki_filepath)
 
@@ -250,7 +327,13 @@ def setup():
         )
 
         backup_lang = setup_backup_dir(app_data_dir, language_to_learn, mother_tongue)
-        config_handler.set_language_pair(language_to_learn, mother_tongue)
+
+        # Add the language pair, and set it as the default if there is none yet, in a single write
+        with config_handler.config_transaction() as config:
+            config_handler.apply_language_pair(config, language_to_learn, mother_tongue)
+            is_first_pair = "default" not in config
+            if is_first_pair:
+                config_handler.apply_default_language_pair(config, language_to_learn, mother_tongue)
 
         click.echo()
         click.echo(f"Translations file: {translations_filepath}")
@@ -261,10 +344,10 @@ def setup():
         click.echo()
     else:
         click.echo(f"{RED}Setup canceled{RESET}")
+        return
 
-    # Set the default language pair
-    if config_handler.get_default_language_pair() is None:
-        config_handler.set_default_language_pair(language_to_learn, mother_tongue)
+    # The language pair has been set as the default if it is the first one
+    if is_first_pair:
         click.echo(
             f"This language pair ({language_to_learn}:{mother_tongue}) has been set as"
             " the default ✅"
@@ -284,10 +367,9 @@ def setup():
             click.echo(f"{BLUE}The new default language pair is:{RESET}")
 
             # Get the new default language pair by reinitalizing the variables to avoid confusion
-            default_language_to_learn = config_handler.get_default_language_pair()[
-                "language_to_learn"
-            ]
-            default_mother_tongue = config_handler.get_default_language_pair()["mother_tongue"]
+            default_language_to_learn, default_mother_tongue = (
+                config_handler.get_default_language_pair()
+            )
             click.echo(
                 f"{BOLD}Language to" f" learn:{RESET} {default_language_to_learn.capitalize()}"
             )
@@ -298,10 +380,9 @@ def setup():
             click.echo("This language pair has not been set as the default ❌")
             click.echo()
             click.echo("The current default language pair is:")
-            default_language_to_learn = config_handler.get_default_language_pair()[
-                "language_to_learn"
-            ]
-            default_mother_tongue = config_handler.get_default_language_pair()["mother_tongue"]
+            default_language_to_learn, default_mother_tongue = (
+                config_handler.get_default_language_pair()
+            )
             click.echo(f"{BOLD}{default_language_to_learn}:{default_mother_tongue}{RESET}")
 
 
@@ -312,8 +393,7 @@ def default():
     """
     print_default_language_pair()
     click.echo()
-    click.echo(f"{BLUE}You can change the default language pair at any time by running:{RESET}")
-    click.echo(f"{BOLD}vocabmaster config default{RESET}")
+    click.echo(CONFIG_DEFAULT_HINT)
 
 
 @vocabmaster.group()
@@ -347,42 +427,24 @@ def config_default_language_pair():
     """
     print_default_language_pair()
 
-    print_all_language_pairs()
+    language_pairs = print_all_language_pairs()
     choice = click.prompt(
         "Type the language pair or its number to set it as the new default",
         type=str,
     )
 
-    # Check if the user entered a correct number
-    if choice.isdigit():
+    # Check if the user entered a number or a language pair
+    try:
         idx = int(choice) - 1
-        if 0 <= idx < len(config_handler.get_all_language_pairs()):
-            # Set the language pair as the default
-            language_to_learn = config_handler.get_all_language_pairs()[idx]["language_to_learn"]
-            mother_tongue = config_handler.get_all_language_pairs()[idx]["mother_tongue"]
-            config_handler.set_default_language_pair(language_to_learn, mother_tongue)
-            click.echo(
-                f"{BOLD}{language_to_learn}:{mother_tongue}{RESET} {GREEN} has been set"
-                f" as the default language pair{RESET} ✅"
-            )
-        else:
-            # The user entered a number that is out of range
-            click.echo(f"{RED}Invalid choice{RESET}")
-            click.echo(
-                "Please enter a number between 1 and"
-                f" {len(config_handler.get_all_language_pairs())}"
-            )
-    else:
-        # Check if the language pair exists
+    except ValueError:
+        # Parse the language pair
         try:
-            if config_handler.get_language_pair(choice) is not None:
-                # Set the language pair as the default
-                language_to_learn, mother_tongue = config_handler.get_language_pair(choice)
+            language_to_learn, mother_tongue = config_handler.get_language_pair(choice)
         # The user entered an invalid language pair
         except ValueError as error:
-            click.echo(f"{RED}{error}{RESET}")
-            click.echo(f"The format is {BOLD}language_to_learn:mother_tongue{RESET}")
-            sys.exit(1)
+            raise CLIAbort(
+                str(error), hint=f"The format is {BOLD}language_to_learn:mother_tongue{RESET}"
+            ) from error
 
         # Set the language pair as the default
         config_handler.set_default_language_pair(language_to_learn, mother_tongue)
@@ -390,6 +452,19 @@ def config_default_language_pair():
             f"{BOLD}{language_to_learn}:{mother_tongue}{RESET} {GREEN} has been set as"
             f" the default language pair{RESET} ✅"
         )
+    else:
+        if 0 <= idx < len(language_pairs):
+            # Set the language pair as the default
+            language_to_learn, mother_tongue = language_pairs[idx]
+            config_handler.set_default_language_pair(language_to_learn, mother_tongue)
+            click.echo(
+                f"{BOLD}{language_to_learn}:{mother_tongue}{RESET} {GREEN} has been set"
+                f" as the default language pair{RESET} ✅"
+            )
+        else:
+            # The user entered a number that is out of range
+            click.echo(f"{RED}Invalid choice{RESET}")
+            click.echo(f"Please enter a number between 1 and {len(language_pairs)}")
 
 
 # @config.command("dir")
@@ -430,7 +505,7 @@ def openai_api_key_explain():
         " https://platform.openai.com/account/api-keys for details."
     )
     click.echo()
-    if platform.system() == "Windows":
+    if operating_system == "Windows":
         click.echo("Then, you can set it up by running `setx OPENAI_API_KEY your_key`")
     else:
         click.echo("Then, you can set it up by running `export OPENAI_API_KEY=YOUR_KEY`")
@@ -443,8 +518,7 @@ def show():
     Show all the language pairs that have been set up.
     """
     print_all_language_pairs()
-    click.echo(f"{BLUE}You can change the default at any time by running:{RESET}")
-    click.echo(f"{BOLD}vocabmaster config default{RESET}")
+    click.echo(CONFIG_DEFAULT_HINT)
 
 
 @vocabmaster.command()
@@ -459,24 +533,46 @@ def tokens():
     not the total cost of the translation.
     The total cost (prompt + translation) cannot exceed $0.008192 per request, though.
     """
-    language_to_learn = config_handler.get_default_language_pair()["language_to_learn"]
-    mother_tongue = config_handler.get_default_language_pair()["mother_tongue"]
-    translations_filepath, anki_file = setup_files(setup_dir(), language_to_learn, mother_tongue)
+    language_to_learn, mother_tongue, translations_filepath, _ = resolve_pair_and_paths(None)
 
-    if csv_handler.vocabulary_list_is_empty(translations_filepath):
+    number_of_words, words_to_translate = csv_handler.read_vocabulary(translations_filepath)
+    if number_of_words == 0:
         click.echo(f"{RED}The list is empty!{RESET}")
         click.echo("Please add words to the list before running this command.")
         sys.exit(0)
 
-    try:
-        words_to_translate = csv_handler.get_words_to_translate(translations_filepath)
-    except Exception as error:
-        click.echo(f"{BLUE}Status:{RESET} {error}")
+    if not words_to_translate:
+        click.echo(
+            f"{BLUE}Status:{RESET} All the words in the vocabulary list already have"
+            " translations and examples"
+        )
         click.echo("Therefore, the cost of the next prompt cannot be estimated.")
-    else:
-        prompt = gpt_integration.format_prompt(language_to_learn, mother_tongue, words_to_translate)
-        estimated_cost = gpt_integration.estimate_prompt_cost(prompt)["gpt-3.5-turbo"]
-        click.echo(f"The estimated cost of the next prompt is {BLUE}${estimated_cost}{RESET}.")
+        return
+
+    estimated_costs = compute_prompt_estimate(language_to_learn, mother_tongue, words_to_translate)
+    estimated_cost = estimated_costs["gpt-3.5-turbo"]
+    click.echo(f"The estimated cost of the next prompt is {BLUE}${estimated_cost}{RESET}.")
+
+
+def compute_prompt_estimate(language_to_learn, mother_tongue, words_to_translate):
+    """
+    Estimates the cost of the next translation prompt for a language pair.
+
+    Args:
+        language_to_learn (str): The language to learn.
+        mother_tongue (str): The user's mother tongue.
+        words_to_translate (list): The words that need translations.
+
+    Returns:
+        dict: The estimated cost of the prompt for each model.
+    """
+    # Imported here to avoid loading tiktoken for the commands that don't need it
+    from vocabmaster import gpt_integration
+
+    num_tokens = gpt_integration.count_prompt_tokens(
+        language_to_learn, mother_tongue, words_to_translate
+    )
+    return gpt_integration.estimate_tokens_cost(num_tokens)
 
 
 def print_default_language_pair():
@@ -484,8 +580,7 @@ def print_default_language_pair():
     Print the current default language pair.
     """
     click.echo(f"{BLUE}The current default language pair is:{RESET}")
-    default_language_to_learn = config_handler.get_default_language_pair()["language_to_learn"]
-    default_mother_tongue = config_handler.get_default_language_pair()["mother_tongue"]
+    default_language_to_learn, default_mother_tongue = config_handler.get_default_language_pair()
     click.echo(f"{BOLD}{ORANGE}{default_language_to_learn}:{default_mother_tongue}{RESET}")
     click.echo()
 
@@ -493,56 +588,20 @@ def print_default_language_pair():
 def print_all_language_pairs():
     """
     Print all the language pairs that have been set up.
+
+    Returns:
+        list: The language pairs that have been printed.
     """
     click.echo(f"{BLUE}The following language pairs have been set up:{RESET}")
     language_pairs = config_handler.get_all_language_pairs()
-    for idx, language_pair in enumerate(language_pairs, start=1):
-        click.echo(
-            f"{idx}." f" {language_pair['language_to_learn']}:{language_pair['mother_tongue']}"
-        )
+    for idx, (language_to_learn, mother_tongue) in enumerate(language_pairs, start=1):
+        click.echo(f"{idx}. {language_to_learn}:{mother_tongue}")
     click.echo()
+    return language_pairs
 
 
 def handle_rate_limit_error():
     """
     Provides guidance on how to handle a rate limit error.
     """
-    click.echo()
-    click.echo(
-        click.style(
-            ("You might not have set a usage rate limit in your" " OpenAI account settings. "),
-            fg="blue",
-        )
-    )
-    click.echo(
-        "If that's the case, you can set it"
-        " here:\nhttps://platform.openai.com/account/billing/limits"
-    )
-
-    click.echo()
-    click.echo(
-        click.style(
-            "If you have set a usage rate limit, please try the following steps:",
-            fg="blue",
-        )
-    )
-    click.echo("- Wait a few seconds before trying again.")
-    click.echo()
-    click.echo(
-        "- Reduce your request rate or batch tokens. You can read the"
-        " OpenAI rate limits"
-        " here:\nhttps://platform.openai.com/account/rate-limits"
-    )
-    click.echo()
-    click.echo(
-        "- If you are using the free plan, you can upgrade to the paid"
-        " plan"
-        " here:\nhttps://platform.openai.com/account/billing/overview"
-    )
-    click.echo()
-    click.echo(
-        "- If you are using the paid plan, you can increase your usage"
-        " rate limit"
-        " here:\nhttps://platform.openai.com/account/billing/limits"
-    )
-    click.echo()
+    click.echo(RATE_LIMIT_GUIDANCE)
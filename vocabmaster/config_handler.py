@@ -1,11 +1,40 @@
+import contextlib
+import copy
+import functools
+import hashlib
 import json
+import os
+from typing import NamedTuple
 
 from vocabmaster import utils
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, it only speeds up the parsing of the configuration
+    orjson = None
 
+
+class LanguagePair(NamedTuple):
+    """A language pair, as stored in the configuration file."""
+
+    language_to_learn: str
+    mother_tongue: str
+
+
+# Parsed configuration, reused as long as the path, modification time, and size of the file
+# are unchanged
+_CONFIG_CACHE = None
+_CONFIG_KEY = None
+
+# Cache key and hash of the configuration file, as last read or written by this process
+_FILE_HASH = (None, None)
+
+
+@functools.cache
 def get_config_filepath():
     """
     Gets the configuration file path.
+    The path is cached, so it is only resolved once per process.
 
     Returns:
         Path: The path to the application's configuration file.
@@ -15,31 +44,111 @@ def get_config_filepath():
     return config_filepath
 
 
+def get_config_key(config_filepath):
+    """
+    Returns the key identifying the current state of the configuration file in the cache.
+
+    The file is only stat'ed once, instead of checking for its existence first.
+
+    Args:
+        config_filepath (Path): The path to the configuration file.
+
+    Returns:
+        tuple: The path, modification time, and size of the file, or None if it doesn't exist.
+    """
+    try:
+        return (str(config_filepath), *utils.get_file_state(config_filepath))
+    except FileNotFoundError:
+        return None
+
+
 def read_config():
     """
     Reads the configuration file.
 
+    The parsed configuration is cached and only read again when the file has been modified.
+    A copy of the cached configuration is returned, so changes made to it by the caller only
+    take effect once saved with `write_config`.
+
     Returns:
         dict: The configuration data as a dictionary, or None if the file doesn't exist.
     """
+    global _CONFIG_CACHE, _CONFIG_KEY, _FILE_HASH
+
     config_filepath = get_config_filepath()
-    if not config_filepath.exists():
+    config_key = get_config_key(config_filepath)
+    if config_key is None:
         return None
-    with open(config_filepath, "r") as file:
-        config = json.load(file)
-    return config
+    if config_key != _CONFIG_KEY:
+        config_bytes = config_filepath.read_bytes()
+        _CONFIG_CACHE = orjson.loads(config_bytes) if orjson else json.loads(config_bytes)
+        _CONFIG_KEY = config_key
+        _FILE_HASH = (config_key, hash_config(config_bytes))
+    return copy.deepcopy(_CONFIG_CACHE)
 
 
 def write_config(config):
     """
     Writes the configuration data to the configuration file.
 
+    The file is written to a temporary file first, then moved into place, so that it is never
+    left half-written. Nothing is written if the file already contains the same configuration.
+
     Args:
         config (dict): The configuration data as a dictionary.
     """
+    global _CONFIG_CACHE, _CONFIG_KEY, _FILE_HASH
+
     config_filepath = get_config_filepath()
-    with open(config_filepath, "w") as file:
-        json.dump(config, file, indent=4)
+    # Always written by the json module, so that the format doesn't depend on orjson being
+    # installed, and an unchanged configuration always serializes to the same bytes
+    payload = json.dumps(config, indent=4).encode("utf-8")
+    payload_hash = hash_config(payload)
+
+    # Skip the write if the file already contains the same configuration, and hasn't been
+    # modified since this process last read or wrote it
+    file_key, file_hash = _FILE_HASH
+    if payload_hash == file_hash and get_config_key(config_filepath) == file_key:
+        _CONFIG_CACHE = copy.deepcopy(config)
+        return
+
+    temporary_filepath = config_filepath.with_suffix(".json.tmp")
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    temporary_fd = os.open(temporary_filepath, flags, 0o644)
+    try:
+        try:
+            utils.write_all(temporary_fd, payload)
+        finally:
+            os.close(temporary_fd)
+        os.replace(temporary_filepath, config_filepath)
+    except BaseException:
+        # Don't leave the temporary file behind in the data directory
+        temporary_filepath.unlink(missing_ok=True)
+        raise
+
+    _CONFIG_CACHE = copy.deepcopy(config)
+    _CONFIG_KEY = get_config_key(config_filepath)
+    _FILE_HASH = (_CONFIG_KEY, payload_hash)
+
+
+def hash_config(config_bytes):
+    """Returns a short hash of the serialized configuration, used to detect unchanged writes."""
+    return hashlib.blake2b(config_bytes, digest_size=16).digest()
+
+
+@contextlib.contextmanager
+def config_transaction():
+    """
+    Reads the configuration once, and writes it back once all the changes have been made.
+
+    Nothing is written if an exception is raised inside the `with` block.
+
+    Yields:
+        dict: The configuration data as a dictionary, to be modified in place.
+    """
+    config = read_config() or {}
+    yield config
+    write_config(config)
 
 
 def set_default_language_pair(language_to_learn, mother_tongue):
@@ -50,12 +159,23 @@ def set_default_language_pair(language_to_learn, mother_tongue):
         language_to_learn (str): The language the user wants to learn.
         mother_tongue (str): The user's mother tongue.
     """
-    config = read_config() or {}
+    with config_transaction() as config:
+        apply_default_language_pair(config, language_to_learn, mother_tongue)
+
+
+def apply_default_language_pair(config, language_to_learn, mother_tongue):
+    """
+    Sets the default language pair in a configuration opened with `config_transaction`.
+
+    Args:
+        config (dict): The configuration data as a dictionary.
+        language_to_learn (str): The language the user wants to learn.
+        mother_tongue (str): The user's mother tongue.
+    """
     config["default"] = {
         "language_to_learn": language_to_learn,
         "mother_tongue": mother_tongue,
     }
-    write_config(config)
 
 
 def set_language_pair(language_to_learn, mother_tongue):
@@ -66,13 +186,34 @@ def set_language_pair(language_to_learn, mother_tongue):
         language_to_learn (str): The language the user wants to learn.
         mother_tongue (str): The user's mother tongue.
     """
-    config = read_config() or {"language_pairs": []}
+    with config_transaction() as config:
+        apply_language_pair(config, language_to_learn, mother_tongue)
+
+
+def apply_language_pair(config, language_to_learn, mother_tongue):
+    """
+    Adds a language pair to a configuration opened with `config_transaction`.
+
+    The pair is not added again if it is already in the configuration, regardless of case.
+
+    Args:
+        config (dict): The configuration data as a dictionary.
+        language_to_learn (str): The language the user wants to learn.
+        mother_tongue (str): The user's mother tongue.
+    """
+    language_pairs = config.setdefault("language_pairs", [])
+    existing_pairs = {
+        (pair["language_to_learn"].casefold(), pair["mother_tongue"].casefold())
+        for pair in language_pairs
+    }
+    if (language_to_learn.casefold(), mother_tongue.casefold()) in existing_pairs:
+        return
+
     new_pair = {
         "language_to_learn": language_to_learn,
         "mother_tongue": mother_tongue,
     }
-    config["language_pairs"].append(new_pair)
-    write_config(config)
+    language_pairs.append(new_pair)
 
 
 def get_default_language_pair():
@@ -80,12 +221,12 @@ def get_default_language_pair():
     Gets the default language pair from the configuration file.
 
     Returns:
-        dict: The default language pair as a dictionary, or None if not found.
+        LanguagePair: The default language pair, or None if not found.
     """
     config = read_config()
     if config is None or "default" not in config:
         return None
-    return config["default"]
+    return LanguagePair(**config["default"])
 
 
 def get_language_pair(language_pair):
@@ -103,12 +244,14 @@ def get_language_pair(language_pair):
 
     Returns:
         tuple: A tuple containing the language to learn and the mother tongue as strings.
+            The languages given in `language_pair` are casefolded, like in `vocabmaster setup`.
     """
     if language_pair:
-        try:
-            language_to_learn, mother_tongue = language_pair.split(":")
-        except ValueError:
+        language_to_learn, separator, mother_tongue = language_pair.partition(":")
+        if not separator or not language_to_learn or not mother_tongue or ":" in mother_tongue:
             raise ValueError("Invalid language pair.")
+        language_to_learn = language_to_learn.casefold()
+        mother_tongue = mother_tongue.casefold()
     else:
         default_pair = get_default_language_pair()
         if default_pair is None:
@@ -117,8 +260,7 @@ def get_language_pair(language_pair):
                 " using 'vocabmaster config default'.\nSee `vocabmaster --help` for"
                 " more information."
             )
-        language_to_learn = default_pair["language_to_learn"]
-        mother_tongue = default_pair["mother_tongue"]
+        language_to_learn, mother_tongue = default_pair
 
     return language_to_learn, mother_tongue
 
@@ -128,10 +270,9 @@ def get_all_language_pairs():
     Gets all language pairs from the configuration file.
 
     Returns:
-        list: A list of language pairs as dictionaries.
-              The keys are 'language_to_learn' and 'mother_tongue'.
+        list: A list of `LanguagePair`.
     """
     config = read_config()
     if config is None or "language_pairs" not in config:
         return None
-    return config["language_pairs"]
+    return [LanguagePair(**language_pair) for language_pair in config["language_pairs"]]
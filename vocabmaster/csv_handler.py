@@ -1,13 +1,32 @@
+import contextlib
 import csv
-from csv import DictReader, DictWriter
+import io
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from vocabmaster import gpt_integration, utils
+from vocabmaster import config_handler, utils
+
+# HTML around the example on the back of the Anki cards
+ANKI_BACK_EXAMPLE_PREFIX = "<br><br><details><summary>example</summary><i>&quot;"
+ANKI_BACK_EXAMPLE_SUFFIX = "&quot;</i></details>"
+
+# Code fences and blank lines the GPT model may add around the CSV content, and the single
+# quotes around its fields
+_GENERATED_TEXT_NOISE = re.compile(r"```(?:csv)?|\n(?=\n)|'")
 
 
 def word_exists(word, translations_filepath):
     """
     Checks if the word is already present in the `translations_filepath`.
 
+    The memory-mapped file is searched for the word, and only the lines containing it are
+    parsed as CSV.
+
     Args:
         word (str): The word to check for its presence in the file.
         translations_filepath (str): The path to the file containing the list of words.
@@ -15,25 +34,45 @@ def word_exists(word, translations_filepath):
     Returns:
         bool: True if the word is found in the file, False otherwise.
     """
-    with open(translations_filepath, encoding="UTF-8") as file:
-        dict_reader = DictReader(file, fieldnames=["word", "translation", "example"])
-        for row in dict_reader:
-            if word == row["word"]:
-                return True
+    if os.path.getsize(translations_filepath) == 0:  # An empty file can't be memory-mapped
         return False
 
+    # Quotes are doubled in quoted fields
+    needle = word.replace('"', '""').encode("UTF-8")
+    with open(translations_filepath, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as content:
+        position = content.find(needle)
+        while position != -1:
+            line_start = content.rfind(b"\n", 0, position) + 1
+            line_end = content.find(b"\n", position)
+            if line_end == -1:
+                line_end = len(content)
+            row = next(csv.reader([content[line_start:line_end].decode("UTF-8")]), None)
+            if row and row[0] == word:
+                return True
+            position = content.find(needle, line_end + 1)
+    return False
+
 
 def append_word(word, translations_filepath):
     """
     Appends the word to the translations file with empty translation and example fields.
 
+    The row is formatted in memory, then appended to the file with a single write.
+
     Args:
         word (str): The word to be appended to the file.
         translations_filepath (str): The path to the file containing the list of words.
     """
-    with open(translations_filepath, "a", encoding="UTF-8") as file:
-        dict_writer = DictWriter(file, fieldnames=["word", "translation", "example"])
-        dict_writer.writerow({"word": word, "translation": "", "example": ""})
+    row = io.StringIO()
+    csv.writer(row).writerow((word, "", ""))
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+    file_descriptor = os.open(translations_filepath, flags, 0o644)
+    try:
+        utils.write_all(file_descriptor, row.getvalue().encode("UTF-8"))
+    finally:
+        os.close(file_descriptor)
 
 
 def get_words_to_translate(translations_filepath):
@@ -49,16 +88,7 @@ def get_words_to_translate(translations_filepath):
     Returns:
         list: A list of words that need translations.
     """
-    words_to_translate = []
-
-    with open(translations_filepath, encoding="UTF-8") as translations_file:
-        dict_reader = DictReader(translations_file)
-        fieldnames = ["word", "translation", "example"]
-
-        for row in dict_reader:
-            # If a row is missing a translation or example, add the word to the list of words to translate
-            if not row["translation"] or not row["example"]:
-                words_to_translate.append(row["word"])
+    _, words_to_translate = read_vocabulary(translations_filepath)
 
     if not words_to_translate:
         raise Exception(
@@ -68,7 +98,68 @@ def get_words_to_translate(translations_filepath):
         return words_to_translate
 
 
-def generate_translations_and_examples(language_to_learn, mother_tongue, translations_filepath):
+def count_words_to_translate(translations_filepath):
+    """
+    Counts the words that need translations, without building the list of words.
+
+    The header row is skipped if present, like in `read_vocabulary`.
+
+    Args:
+        translations_filepath (str): The path to the CSV file containing words, translations, and examples.
+
+    Returns:
+        int: The number of words that need translations.
+    """
+    with open(translations_filepath, encoding="UTF-8", newline="", buffering=1 << 20) as file:
+        rows = (row for row in csv.reader(file) if row)
+        first_row = next(rows, None)
+        if first_row is None:
+            return 0
+        number_words = 0 if _is_header(first_row) else int(_needs_translation(first_row))
+        return number_words + sum(1 for row in rows if _needs_translation(row))
+
+
+def _is_header(row):
+    """Returns True if the row is the fieldnames row of the translations file."""
+    return row == ["word", "translation", "example"]
+
+
+def _needs_translation(row):
+    """Returns True if the row is missing either the 'translation' or the 'example' column."""
+    return len(row) < 3 or not row[1] or not row[2]
+
+
+def read_vocabulary(translations_filepath):
+    """
+    Reads the vocabulary list in a single pass.
+
+    The header row is skipped if present. A word needs a translation if its row is missing
+    either the 'translation' or the 'example' column.
+
+    Args:
+        translations_filepath (str): The path to the CSV file containing words, translations, and examples.
+
+    Returns:
+        tuple: The number of words in the vocabulary list, and the list of words that need translations.
+    """
+    number_of_words = 0
+    words_to_translate = []
+
+    with open(translations_filepath, encoding="UTF-8", newline="", buffering=1 << 20) as file:
+        csv_reader = csv.reader(file)
+        for row in csv_reader:
+            if not row or (number_of_words == 0 and _is_header(row)):
+                continue
+            number_of_words += 1
+            if _needs_translation(row):
+                words_to_translate.append(row[0])
+
+    return number_of_words, words_to_translate
+
+
+def generate_translations_and_examples(
+    language_to_learn, mother_tongue, translations_filepath, concurrency=1, backup_dir=None
+):
     """
     Generates translations and examples for a list of words using the GPT model.
 
@@ -77,26 +168,65 @@ def generate_translations_and_examples(language_to_learn, mother_tongue, transla
     `gpt_integration.format_prompt` and sends a request to the GPT model. The generated text from
     the GPT model is returned.
 
+    If `concurrency` is greater than 1, the words are split into as many chunks, and one request
+    per chunk is sent in parallel. Each response is then printed and backed up as soon as it is
+    received, instead of streamed.
+
     Args:
         language_to_learn (str): The language to learn.
         mother_tongue (str): The user's mother tongue.
         translations_filepath (str): The path to the input CSV file containing words,
                                        translations, and examples.
+        concurrency (int): The maximum number of requests sent in parallel.
+        backup_dir (Path): The directory where the GPT responses are backed up. Defaults to the
+            backup directory of the language pair.
 
     Returns:
         str: The generated text containing translations and examples.
     """
-    # Get the list of words that need translations and generate the GPT model prompt
+    # Imported here to avoid loading openai for the commands that don't need it
+    from vocabmaster import gpt_integration
+
+    # Get the list of words that need translations
     words_to_translate = get_words_to_translate(translations_filepath)
-    prompt = gpt_integration.format_prompt(language_to_learn, mother_tongue, words_to_translate)
+    if backup_dir is None:
+        backup_dir = utils.get_backup_dir(language_to_learn, mother_tongue)
 
-    # Send a request to the GPT model and extract the generated text
-    gpt_response = gpt_integration.chatgpt_request(prompt=prompt, stream=True, temperature=0.6)
-    generated_text = gpt_response[0]
+    if concurrency <= 1 or len(words_to_translate) == 1:
+        # Generate the GPT model prompt, send the request and extract the generated text
+        prompt = gpt_integration.format_prompt(language_to_learn, mother_tongue, words_to_translate)
+        gpt_response = gpt_integration.chatgpt_request(prompt=prompt, stream=True, temperature=0.6)
+        generated_text = gpt_response[0]
 
-    # Create a backup of the GPT response
-    backup_dir = utils.get_backup_dir(language_to_learn, mother_tongue)
-    utils.backup_content(backup_dir, gpt_response)
+        # Create a backup of the GPT response
+        utils.backup_content(backup_dir, gpt_response)
+
+        return generated_text
+
+    # Split the words into one chunk per request, and send the requests in parallel
+    chunk_size = math.ceil(len(words_to_translate) / concurrency)
+    prompts = [
+        gpt_integration.format_prompt(
+            language_to_learn, mother_tongue, words_to_translate[i : i + chunk_size]
+        )
+        for i in range(0, len(words_to_translate), chunk_size)
+    ]
+    backup_lock = threading.Lock()
+
+    def request_chunk(prompt):
+        gpt_response = gpt_integration.chatgpt_request(
+            prompt=prompt, temperature=0.6, print_response=True
+        )
+
+        # Create a backup of the GPT response right away, so that it is kept even if another
+        # request fails. The backups are rotated, so they are made one at a time.
+        with backup_lock:
+            utils.backup_content(backup_dir, gpt_response)
+
+        return gpt_response[0].strip()
+
+    with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+        generated_text = "\n".join(executor.map(request_chunk, prompts))
 
     return generated_text
 
@@ -108,29 +238,39 @@ def convert_text_to_dict(generated_text):
     The text should be in the format:
     "'word1',"translation1","example1"\n'word2',"translation2","example2"'
 
+    The word is everything before the first comma, and the example everything after the last
+    one, since the translations are a comma-separated list. Lines without two commas are skipped,
+    and returned so that they can be reported.
+
     Args:
         generated_text (str): The text to be cleaned and converted.
 
     Returns:
-        dict: A dictionary with words as keys and a dictionary of translations and examples as values.
+        tuple: A dictionary with words as keys and a dictionary of translations and examples as
+            values, and the list of lines that couldn't be parsed.
     """
     # Clean input text and split it into lines
-    cleaned_text = generated_text.replace("\n\n", "\n")
+    cleaned_text = _GENERATED_TEXT_NOISE.sub("", generated_text)
     lines = cleaned_text.strip().split("\n")
 
     # Create a dictionary of words with translations and examples
     result = {}
+    skipped_lines = []
     for line in lines:
-        word, translation_and_example = line.split(",", 1)
-        translation, example = translation_and_example.rsplit(",", 1)
-        result[word.replace("'", "")] = {
-            "translation": translation.replace("'", ""),
-            "example": example.replace("'", ""),
+        word, _, translation_and_example = line.partition(",")
+        translation, separator, example = translation_and_example.rpartition(",")
+        if not separator:
+            if line.strip():
+                skipped_lines.append(line)
+            continue
+        result[word] = {
+            "translation": translation,
+            "example": example,
         }
-    return result
+    return result, skipped_lines
 
 
-def add_translations_and_examples_to_file(translations_filepath, pair):
+def add_translations_and_examples_to_file(translations_filepath, pair, concurrency=1):
     """
     Updates the translations file with new translations and examples.
 
@@ -140,42 +280,58 @@ def add_translations_and_examples_to_file(translations_filepath, pair):
 
     Args:
         translations_filepath (str): The path to the CSV file containing the translations and examples.
-    Returns:
         pair (str): The language pair in the format: 'language_to_learn:mother_tongue'.
+        concurrency (int): The maximum number of requests sent to the GPT model in parallel.
 
-        None
+    Returns:
+        list: The lines of the GPT response that couldn't be parsed. The words they were meant
+            for are left without translations and examples.
     """
     # Generate new translations and examples, then convert the results to a dictionary
-    language_to_learn, mother_tongue = utils.get_language_pair_from_option(pair)
+    language_to_learn, mother_tongue = config_handler.get_language_pair(pair)
+    backup_dir = utils.get_backup_dir(language_to_learn, mother_tongue)
 
-    new_entries = convert_text_to_dict(
-        generate_translations_and_examples(language_to_learn, mother_tongue, translations_filepath)
+    new_entries, skipped_lines = convert_text_to_dict(
+        generate_translations_and_examples(
+            language_to_learn, mother_tongue, translations_filepath, concurrency, backup_dir
+        )
     )
 
-    # Read the current entries from the input file and store them in a dictionary
-    with open(translations_filepath, "r", encoding="UTF-8") as input_file:
-        translations_reader = DictReader(input_file)
-        current_entries = {row["word"]: row for row in translations_reader}
-
-    # Write the updated translations and examples to the output file
-    with open(translations_filepath, "w", encoding="UTF-8") as output_file:
-        fieldnames = ["word", "translation", "example"]
-        writer = DictWriter(output_file, fieldnames=fieldnames)
-        writer.writeheader()
-
-        # Iterate through the current entries and update them with the new translations and examples
-        for word, current_entry in current_entries.items():
-            if word in new_entries and not current_entry["translation"]:
-                current_entry["translation"] = new_entries[word]["translation"]
-                current_entry["example"] = new_entries[word]["example"]
-
-            # Write the updated entry to the output file
-            writer.writerow(current_entry)
+    # Stream the current entries to a temporary file, updating them along the way, then move it
+    # into place so that the translations file is never left half-written
+    temporary_filepath = f"{translations_filepath}.tmp"
+    try:
+        with open(
+            translations_filepath, encoding="UTF-8", newline="", buffering=1 << 20
+        ) as input_file, open(
+            temporary_filepath, "w", encoding="UTF-8", newline="", buffering=1 << 20
+        ) as output_file:
+            reader = csv.reader(input_file)
+            next(reader, None)  # Skip the fieldnames
+            writer = csv.writer(output_file)
+            writer.writerow(["word", "translation", "example"])
+
+            for row in reader:
+                if not row:
+                    continue
+                word, translation, example = (row + ["", ""])[:3]
+                if word in new_entries and not translation:
+                    translation = new_entries[word]["translation"]
+                    example = new_entries[word]["example"]
+                writer.writerow([word, translation, example])
+
+        os.replace(temporary_filepath, translations_filepath)
+    except BaseException:
+        # Don't leave the temporary file behind in the data directory
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_filepath)
+        raise
 
     # Create a backup of the translations file
-    backup_dir = utils.get_backup_dir(language_to_learn, mother_tongue)
     utils.backup_file(backup_dir, translations_filepath)
 
+    return skipped_lines
+
 
 def generate_anki_output_file(translations_filepath, anki_output_file):
     """
@@ -192,60 +348,76 @@ def generate_anki_output_file(translations_filepath, anki_output_file):
     Returns:
         None
     """
-    with open(translations_filepath, encoding="UTF-8") as translations_file, open(
-        anki_output_file, "w", encoding="UTF-8"
+    with open(
+        translations_filepath, encoding="UTF-8", newline="", buffering=1 << 20
+    ) as translations_file, open(
+        anki_output_file, "w", encoding="UTF-8", newline="", buffering=1 << 20
     ) as anki_file:
-        translations_dict_reader = DictReader(
-            translations_file, fieldnames=["word", "translation", "example"]
-        )
-        next(translations_dict_reader)
+        translations_reader = csv.reader(translations_file)
+        next(translations_reader, None)  # Skip the fieldnames
 
-        anki_dict_writer = DictWriter(
-            anki_file,
-            fieldnames=["front", "back"],
-            quoting=csv.QUOTE_MINIMAL,
-            delimiter=";",
-        )
+        anki_writer = csv.writer(anki_file, quoting=csv.QUOTE_MINIMAL, delimiter=";")
 
-        for translations in translations_dict_reader:
-            if not translations["translation"] or not translations["example"]:
-                continue
-            else:
-                translations["translation"] = translations["translation"].strip('"')
+        # Write all the cards to the Anki output file in a single call
+        anki_writer.writerows(generate_anki_cards(translations_reader))
 
-                # Create a card with the word on the front, and the translations and example on the back
-                card = {
-                    "front": translations["word"],
-                    "back": f"{translations['translation']}<br><br><details><summary>example</summary><i>&quot;{translations['example']}&quot;</i></details>",
-                }
 
-                # Write the card to the Anki output file
-                anki_dict_writer.writerow(card)
+def generate_anki_cards(translations_rows):
+    """
+    Generates the Anki cards of the translated words.
+
+    Args:
+        translations_rows (iterable): The rows of the translations file, without the fieldnames.
+
+    Yields:
+        tuple: A card with the word on the front, and the translations and example on the back.
+    """
+    for row in translations_rows:
+        if len(row) < 3 or not row[1] or not row[2]:
+            continue
+        yield (
+            row[0],
+            "".join(
+                (row[1].strip('"'), ANKI_BACK_EXAMPLE_PREFIX, row[2], ANKI_BACK_EXAMPLE_SUFFIX)
+            ),
+        )
 
 
 def add_fieldnames_to_csv_file(translations_filepath, fieldnames):
     """
     Adds fieldnames to a CSV file if it's missing.
 
+    Only the first row is parsed to check for the fieldnames. If they're missing, they are written
+    to a temporary file, followed by the content of the file copied in chunks, and the temporary
+    file is then moved into place.
+
     Args:
         translations_filepath (str): The path to the CSV file.
         fieldnames (list): A list of strings containing the column names.
     """
-    with open(translations_filepath, "r+", encoding="UTF-8") as file:
-        # Check if the fieldnames is already present in the first row of the content
-        for line in file:
-            if line.startswith(",".join(fieldnames)):
+    temporary_filepath = f"{translations_filepath}.tmp"
+    try:
+        with open(translations_filepath, "rb", buffering=1 << 20) as file:
+            # Check if the fieldnames is already present in the first row of the content
+            first_row = next(csv.reader([file.readline().decode("UTF-8")]), None)
+            if first_row == list(fieldnames):
                 return
-            else:
-                break
+            file.seek(0, 0)  # Move the file pointer to the beginning of the file
 
-        file.seek(0, 0)  # Move the file pointer to the beginning of the file
-        content = file.read()
-        file.seek(0, 0)
+            with open(temporary_filepath, "w", encoding="UTF-8", newline="") as temporary_file:
+                writer = csv.writer(temporary_file)
+                writer.writerow(fieldnames)  # Write the fieldnames to the first row
+                temporary_file.flush()
 
-        writer = csv.writer(file)
-        writer.writerow(fieldnames)  # Write the fieldnames to the first row
-        file.write(content)  # Write the original content after the fieldnames
+                # Copy the original content after the fieldnames
+                shutil.copyfileobj(file, temporary_file.buffer, 1 << 16)
+
+        os.replace(temporary_filepath, translations_filepath)
+    except BaseException:
+        # Don't leave the temporary file behind in the data directory
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_filepath)
+        raise
 
 
 def vocabulary_list_is_empty(translations_filepath):
@@ -258,8 +430,9 @@ def vocabulary_list_is_empty(translations_filepath):
     Returns:
         bool: True if the vocabulary list is empty, False otherwise.
     """
-    with open(translations_filepath, encoding="UTF-8") as file:
+    with open(translations_filepath, encoding="UTF-8", newline="") as file:
         csv_reader = csv.reader(file)
-        next(csv_reader)  # Skip the fieldnames
-        if len(list(csv_reader)) == 0:
-            return True
+        next(csv_reader, None)  # Skip the fieldnames
+
+        # Stop at the first row that isn't blank
+        return not any(csv_reader)
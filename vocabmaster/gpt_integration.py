@@ -1,13 +1,20 @@
+import functools
 import os
+import random
 import time
 
 import openai
-import tiktoken
 
 
 def format_prompt(language_to_learn, mother_tongue, words_to_translate):
-    words_to_translate = "\n".join(words_to_translate)
-    prompt = [
+    prompt = format_preamble(language_to_learn, mother_tongue)
+    prompt[-1]["content"] += "\n".join(words_to_translate)
+    return prompt
+
+
+def format_preamble(language_to_learn, mother_tongue):
+    """Returns the prompt messages that come before the list of words to translate."""
+    return [
         {
             "role": "system",
             "content": """
@@ -31,10 +38,9 @@ def format_prompt(language_to_learn, mother_tongue, words_to_translate):
             The format should look like this:
             word,'translation1, translation2, translation3','example'.
             ---
-            {words_to_translate}""",
+            """,
         },
     ]
-    return prompt
 
 
 def chatgpt_request(
@@ -45,20 +51,35 @@ def chatgpt_request(
     temperature=0.7,
     stop=None,
     stream=False,
+    max_retries=3,
+    max_retry_wait=4,
+    print_response=False,
 ):
     start_time = time.monotonic_ns()
     openai.api_key = os.getenv("OPENAI_API_KEY")
 
-    # Make the API request
-    response = openai.ChatCompletion.create(
-        messages=prompt,
-        model=model,
-        # max_tokens=max_tokens,
-        n=n,
-        temperature=temperature,
-        stop=stop,
-        stream=stream,
-    )
+    # Make the API request. On rate limit errors, back off exponentially with full jitter, so that
+    # parallel requests don't retry in lockstep, and give up after `max_retry_wait` seconds
+    retry_wait = 0
+    for attempt in range(max_retries + 1):
+        try:
+            response = openai.ChatCompletion.create(
+                messages=prompt,
+                model=model,
+                # max_tokens=max_tokens,
+                n=n,
+                temperature=temperature,
+                stop=stop,
+                stream=stream,
+            )
+        except openai.error.RateLimitError:
+            delay = random.uniform(0, 2**attempt)
+            if attempt == max_retries or retry_wait + delay > max_retry_wait:
+                raise
+            retry_wait += delay
+            time.sleep(delay)
+        else:
+            break
 
     if stream:
         # Create variables to collect the stream of chunks
@@ -81,6 +102,8 @@ def chatgpt_request(
     else:
         # Extract and save the generated response
         generated_text = response["choices"][0]["message"]["content"]
+        if print_response:
+            print(generated_text.strip())
 
         # Save the time delay
         response_time = (time.monotonic_ns() - start_time) / 1e9
@@ -92,9 +115,22 @@ def chatgpt_request(
     )
 
 
+@functools.lru_cache(maxsize=8)
+def get_encoding(model):
+    """
+    Returns the tiktoken encoding for a model.
+
+    The result is cached so that the BPE tables are only loaded once per process.
+    tiktoken itself is imported on first use, as only the token counting needs it.
+    """
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
+
 def num_tokens_from_string(string, model="gpt-3.5-turbo-0613"):
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model(model)
+    encoding = get_encoding(model)
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
@@ -102,8 +138,10 @@ def num_tokens_from_string(string, model="gpt-3.5-turbo-0613"):
 def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
     """Returns the number of tokens used by a list of messages."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        encoding = get_encoding(model)
     except KeyError:
+        import tiktoken
+
         print("Warning: model not found. Using cl100k_base encoding.")
         encoding = tiktoken.get_encoding("cl100k_base")
     if model == "gpt-3.5-turbo":
@@ -136,6 +174,41 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
     return num_tokens
 
 
+@functools.lru_cache(maxsize=100_000)
+def num_tokens_from_word(word, model="gpt-3.5-turbo-0613"):
+    """Returns the number of tokens in a word, caching the result."""
+    return len(get_encoding(model).encode(word))
+
+
+@functools.lru_cache(maxsize=32)
+def num_tokens_from_prompt_template(language_to_learn, mother_tongue, model="gpt-3.5-turbo-0613"):
+    """Returns the number of tokens used by the prompt without any word to translate."""
+    return num_tokens_from_messages(format_preamble(language_to_learn, mother_tongue), model)
+
+
+def count_prompt_tokens(
+    language_to_learn, mother_tongue, words_to_translate, model="gpt-3.5-turbo-0613"
+):
+    """
+    Returns the number of tokens of the prompt for a list of words, without building the prompt.
+
+    The words are tokenized (in parallel for long lists) and added to the cached token count
+    of the preamble, plus one newline token between each word. The result is an estimate that
+    may differ by a few tokens from `num_tokens_from_messages(format_prompt(...))`.
+    """
+    num_tokens = num_tokens_from_prompt_template(language_to_learn, mother_tongue, model)
+    if len(words_to_translate) < 1000:
+        # Short lists are cheaper to count word by word from the cache
+        num_tokens += sum(num_tokens_from_word(word, model) for word in words_to_translate)
+    else:
+        encoding = get_encoding(model)
+        num_threads = min(8, os.cpu_count() or 1)
+        encoded_words = encoding.encode_batch(list(words_to_translate), num_threads=num_threads)
+        num_tokens += sum(map(len, encoded_words))
+    num_tokens += max(len(words_to_translate) - 1, 0)  # newlines between the words
+    return num_tokens
+
+
 def estimated_cost(num_tokens, price_per_1k_tokens):
     """Returns the estimated cost of a number of tokens."""
     return f"{num_tokens / 1000 * price_per_1k_tokens:.6f}"
@@ -143,16 +216,17 @@ def estimated_cost(num_tokens, price_per_1k_tokens):
 
 def estimate_prompt_cost(message):
     """Returns the estimated cost of a prompt."""
-    num_tokens = num_tokens_from_messages(message)
+    return estimate_tokens_cost(num_tokens_from_messages(message))
+
 
+def estimate_tokens_cost(num_tokens):
+    """Returns the estimated cost of a number of tokens for each model."""
     prices = {
         "gpt-3.5-turbo": 0.0015,
         "gpt-3.5-turbo-0613": 0.0015,
-        "gpt-3.5-turbo-0613": 0.0015,
         "gpt-3.5-turbo-16k": 0.003,
         "gpt-4": 0.03,
         "gpt-4-0613": 0.03,
-        "gpt-4-0613": 0.03,
         "gpt-4-32k": 0.06,
         "gpt-4-32k-0613": 0.06,
     }
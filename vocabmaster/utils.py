@@ -1,21 +1,30 @@
+import functools
 import os
 import platform
 import shutil
+import sys
 from datetime import datetime
 from pathlib import Path
 
-from vocabmaster import config_handler
-
 
+@functools.cache
 def setup_dir():
     """
     Creates the application data directory if it doesn't exist and returns its path.
     The directory location is determined based on the global app_name variable and the user's operating system.
+    The path is cached, so the directory is only resolved and created once per process.
+    The `VOCABMASTER_DATA_DIR` environment variable, if set, overrides the default location.
+    A relative path in it is resolved against the current directory.
 
     Returns:
         pathlib.Path: The path to the application data directory.
     """
-    match platform.system():
+    if data_dir := os.environ.get("VOCABMASTER_DATA_DIR"):
+        app_data_dir = Path(data_dir).expanduser().resolve()
+        app_data_dir.mkdir(exist_ok=True, parents=True)
+        return app_data_dir
+
+    match operating_system:
         case "Windows":
             app_data_dir = Path.home() / "AppData" / "Roaming" / app_name
         case "Linux" | "Darwin":
@@ -36,9 +45,11 @@ def setup_dir():
     return app_data_dir
 
 
+@functools.lru_cache(maxsize=64)
 def setup_files(app_data_dir, language_to_learn, mother_tongue):
     """
     Creates the necessary file paths in the data directory if they don't exist.
+    The paths are cached, so the files are only checked once per process for each language pair.
 
     Args:
     app_data_dir (pathlib.Path): The directory where the application data files should be created.
@@ -150,41 +161,42 @@ def backup_file(backup_dir, filepath):
         oldest_backup_file.unlink()
 
 
-def generate_iso_timestamp():
+def get_file_state(filepath):
     """
-    Generates an ISO 8601 formatted timestamp with colons replaced by underscores.
+    Returns the modification time and size of a file, used to detect changes to it.
+
+    Args:
+        filepath (pathlib.Path): The path to the file.
 
     Returns:
-        str: The generated ISO 8601 formatted timestamp with colons replaced by underscores.
+        tuple: The modification time in nanoseconds and the size of the file.
     """
-    now = datetime.now()
-    return now.isoformat().replace(":", "_")
+    stat = os.stat(filepath)
+    return stat.st_mtime_ns, stat.st_size
 
 
-def get_language_pair_from_option(pair):
+def write_all(file_descriptor, data):
     """
-    Gets the language pair based on the input option string or the default language pair.
-
-    If the 'pair' argument is not empty, the function will extract the mother tongue and language
-    to learn from the input string. If the 'pair' argument is empty, the default language pair
-    from the configuration file will be used.
+    Writes all the data to a file descriptor, as `os.write` may write only part of it.
 
     Args:
-        pair (str): A string containing the language pair separated by a colon, e.g. "english:french",
-            where 'english' is the language to learn and 'french' is the mother tongue. If empty, the default
-            language pair from the configuration file will be used.
+        file_descriptor (int): The file descriptor to write to.
+        data (bytes): The data to write.
+    """
+    data = memoryview(data)
+    while data:
+        data = data[os.write(file_descriptor, data) :]
 
-    Returns:
-        tuple: A tuple containing the language to learn and the mother tongue as strings.
+
+def generate_iso_timestamp():
     """
-    if pair:
-        language_to_learn, mother_tongue = pair.split(":")
-    else:
-        default_pair = config_handler.get_default_language_pair()
-        language_to_learn = default_pair["language_to_learn"]
-        mother_tongue = default_pair["mother_tongue"]
+    Generates an ISO 8601 formatted timestamp with colons replaced by underscores.
 
-    return language_to_learn, mother_tongue
+    Returns:
+        str: The generated ISO 8601 formatted timestamp with colons replaced by underscores.
+    """
+    now = datetime.now()
+    return now.isoformat().replace(":", "_")
 
 
 def openai_api_key_exists():
@@ -198,10 +210,15 @@ def openai_api_key_exists():
 
 
 app_name = "vocabmaster"
+operating_system = platform.system()
 app_data_dir = setup_dir()
-BLUE = "\x1b[94m"
-BOLD = "\x1b[1m"
-GREEN = "\x1b[92m"
-ORANGE = "\x1b[93m"
-RED = "\x1b[91m"
-RESET = "\x1b[0m"
+
+# The ANSI escape codes are left empty when either the output or the error stream is not a
+# terminal, since the same codes are used for the messages written to both
+use_color = sys.stdout.isatty() and sys.stderr.isatty()
+BLUE = "\x1b[94m" if use_color else ""
+BOLD = "\x1b[1m" if use_color else ""
+GREEN = "\x1b[92m" if use_color else ""
+ORANGE = "\x1b[93m" if use_color else ""
+RED = "\x1b[91m" if use_color else ""
+RESET = "\x1b[0m" if use_color else ""